@@ -1,31 +1,185 @@
 # etl.py
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import json
 import os
 import re
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from random import random
+from diskcache import Cache
 
 OUTPUT_DIR = "outputs"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-logging.basicConfig(
-    filename="logs/etl.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
 
 HWM_FILE = os.path.join(OUTPUT_DIR, "high_water_mark.json")
 
+# Cleaned employees: a directory-of-files Parquet dataset that each run appends
+# one file to, keyed by the HWM the batch starts after
+CLEAN_DATA_PATH = os.path.join(OUTPUT_DIR, "clean_data.parquet")
+# Natural key of an employee record, used to de-duplicate each batch
+EMPLOYEE_KEY_COLS = ["person_id", "company_ein", "start_date"]
+
+# Arrow-backed read schemas. Date columns stay strings so malformed values are
+# coerced (and reported) by pd.to_datetime instead of failing the read.
+_STR = pd.ArrowDtype(pa.string())
+EMPLOYEES_SCHEMA = {
+    "person_id": pd.ArrowDtype(pa.int64()),
+    "full_name": _STR,
+    "title": _STR,
+    "email": _STR,
+    "company_ein": _STR,
+    "start_date": _STR,
+    "notes": _STR,
+}
+PLANS_SCHEMA = {
+    "company_ein": _STR,
+    "plan_type": _STR,
+    "carrier_name": _STR,
+    "start_date": _STR,
+    "end_date": _STR,
+}
+CLAIMS_SCHEMA = {
+    "claim_id": pd.ArrowDtype(pa.int64()),
+    "company_ein": _STR,
+    "service_date": _STR,
+    "amount": pd.ArrowDtype(pa.float64()),
+    "claim_type": _STR,
+}
+
+EMAIL_RE = re.compile(r"[^@]+@[^@]+\.[^@]+")
+
+# Successful enrichments persist across runs; entries expire after a day
+ENRICH_CACHE_DIR = os.path.join(OUTPUT_DIR, "enrich_cache")
+ENRICH_CACHE_TTL = 86400
+ENRICH_MAX_WORKERS = 16
+
+
+# The raw CSVs only ever grow by appended rows. Each is mirrored into a Parquet
+# dataset that is extended with just the new rows, then read with the HWM
+# pushed down as a filter on a parsed timestamp column.
+# name -> (csv path, schema, date column)
+SOURCES = {
+    "employees": ("data/employees_raw.csv", EMPLOYEES_SCHEMA, "start_date"),
+    "plans": ("data/plans_raw.csv", PLANS_SCHEMA, "start_date"),
+    "claims": ("data/claims_raw.csv", CLAIMS_SCHEMA, "service_date"),
+}
+RAW_MIRROR_DIR = os.path.join(OUTPUT_DIR, "raw_parquet")
+
+
+def sync_raw_mirror(name):
+    """Append CSV rows not yet in the source's Parquet mirror as a new part file."""
+    csv_path, schema, date_col = SOURCES[name]
+    mirror = os.path.join(RAW_MIRROR_DIR, name)
+    os.makedirs(mirror, exist_ok=True)
+
+    # Rows already mirrored, from the part footers only
+    synced = ds.dataset(mirror, format="parquet").count_rows()
+
+    # Skipped rows are only split on line boundaries, never type-converted
+    new_rows = pacsv.read_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(skip_rows_after_names=synced),
+        convert_options=pacsv.ConvertOptions(
+            column_types={col: dtype.pyarrow_dtype for col, dtype in schema.items()},
+            strings_can_be_null=True,
+        ),
+    )
+    if new_rows.num_rows == 0:
+        return mirror
+
+    # Unparseable dates become null, so the HWM filter skips them like NaT did
+    dates = pd.to_datetime(new_rows.column(date_col).to_pandas(), errors="coerce")
+    table = new_rows.append_column(
+        "_row", pa.array(range(synced, synced + new_rows.num_rows), pa.int64())
+    ).append_column("_date", pa.Array.from_pandas(dates, type=pa.timestamp("ns")))
+
+    # Named by first row, so a retried sync overwrites rather than duplicates
+    pq.write_table(table, os.path.join(mirror, f"part-{synced:012d}.parquet"))
+    logging.info(f"Mirrored {new_rows.num_rows} new rows of {csv_path}")
+    return mirror
+
+
+def load_source(name, hwm_value):
+    """Load a source's rows dated after the HWM (all rows if there is none)."""
+    mirror = sync_raw_mirror(name)
+    _, schema, _ = SOURCES[name]
+
+    row_filter = None
+    if hwm_value:
+        cutoff = pa.scalar(pd.Timestamp(hwm_value).value, type=pa.timestamp("ns"))
+        row_filter = ds.field("_date") > cutoff
+
+    table = ds.dataset(mirror, format="parquet").to_table(
+        columns=["_row", *schema], filter=row_filter
+    )
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    # Original CSV row number as the index, so row_id is stable across runs
+    df.index = pd.Index(df.pop("_row").to_numpy(), dtype="int64")
+    return df.sort_index()
+
+
+def migrate_legacy_clean_data():
+    """
+    Turn a single-file clean_data.parquet from earlier runs into a dataset
+    directory holding that file, using renames only so no history is lost if
+    the process dies midway.
+    """
+    staging = CLEAN_DATA_PATH + ".migrating"
+    if os.path.isfile(CLEAN_DATA_PATH):
+        os.makedirs(staging, exist_ok=True)
+        os.replace(CLEAN_DATA_PATH, os.path.join(staging, "part-legacy.parquet"))
+    if os.path.isdir(staging) and not os.path.exists(CLEAN_DATA_PATH):
+        os.replace(staging, CLEAN_DATA_PATH)
+
+
+def append_clean_data(table, after_hwm):
+    """
+    Write a batch of cleaned rows as a new file in the clean_data dataset.
+
+    The file is named after the HWM the batch starts from, so a run retried
+    before the HWM was saved overwrites its earlier part instead of adding one.
+    """
+    migrate_legacy_clean_data()
+    os.makedirs(CLEAN_DATA_PATH, exist_ok=True)
+
+    batch_key = (
+        pd.Timestamp(after_hwm).strftime("%Y%m%dT%H%M%S") if after_hwm else "initial"
+    )
+    pq.write_table(
+        table,
+        os.path.join(CLEAN_DATA_PATH, f"part-after-{batch_key}.parquet"),
+        compression="zstd",
+        compression_level=3,
+        use_dictionary=True,  # company_ein, title, industry etc. repeat heavily
+        row_group_size=131072,
+    )
+
+
+def write_hwm(hwm):
+    """Atomically replace the high-water mark file."""
+    tmp_file = HWM_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(hwm, f)
+    os.replace(tmp_file, HWM_FILE)
+
+
+def init_output_dir():
+    """Create the outputs/ directory shared by the ETL and the SQL exports."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
 
 def run_etl():
-    # -----------------------------
-    # Load CSVs
-    # -----------------------------
-    employees = pd.read_csv("data/employees_raw.csv")
-    plans = pd.read_csv("data/plans_raw.csv")
-    claims = pd.read_csv("data/claims_raw.csv")
+    init_output_dir()
+    logging.basicConfig(
+        filename="logs/etl.log",
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
 
     # -----------------------------
     # Load company lookup & API mock
@@ -45,22 +199,12 @@ def run_etl():
     else:
         hwm = {"employees": None, "plans": None, "claims": None}
 
-    # Filter only new rows for incremental run
-    if hwm["employees"]:
-        employees = employees[
-            pd.to_datetime(employees["start_date"], errors="coerce")
-            > pd.to_datetime(hwm["employees"])
-        ]
-    if hwm["plans"]:
-        plans = plans[
-            pd.to_datetime(plans["start_date"], errors="coerce")
-            > pd.to_datetime(hwm["plans"])
-        ]
-    if hwm["claims"]:
-        claims = claims[
-            pd.to_datetime(claims["service_date"], errors="coerce")
-            > pd.to_datetime(hwm["claims"])
-        ]
+    # -----------------------------
+    # Load only rows past the HWM (filter pushed into the Parquet scan)
+    # -----------------------------
+    employees = load_source("employees", hwm["employees"])
+    plans = load_source("plans", hwm["plans"])
+    claims = load_source("claims", hwm["claims"])
 
     # -----------------------------
     # Early return if no new rows
@@ -71,52 +215,46 @@ def run_etl():
         return
 
     # -----------------------------
-    # Helper functions
+    # Validation and cleaning employees
     # -----------------------------
-    def safe_email(email):
-        return bool(re.match(r"[^@]+@[^@]+\.[^@]+", str(email)))
+    # Validation errors, kept as column arrays
+    err_ids, err_fields, err_reasons = [], [], []
 
-    def infer_ein(email):
-        if pd.isna(email) or "@" not in email:
-            return None
-        domain = email.split("@")[1]
-        return company_lookup.get(domain)
+    def add_errors(row_ids, field, reason):
+        err_ids.extend(row_ids)
+        err_fields.extend([field] * len(row_ids))
+        err_reasons.extend([reason] * len(row_ids))
 
-    # -----------------------------
-    # Validation and cleaning employees
-    # -----------------------------
     if not employees.empty:
         employees["row_id"] = employees.index
-        errors = []
 
-        # Infer EINs if missing
-        employees["company_ein"] = employees["company_ein"].fillna(
-            employees["email"].apply(infer_ein)
-        )
+        # Infer EINs if missing (email domain -> company lookup)
+        domains = employees["email"].str.extract(r"@(?P<domain>.*)", expand=False)
+        inferred = domains.map(company_lookup)
+        employees["company_ein"] = employees["company_ein"].fillna(inferred)
 
-        # Validate emails
-        for idx, email in employees["email"].items():
-            if not safe_email(email):
-                errors.append(
-                    {"row_id": idx, "field": "email", "error_reason": "Invalid email"}
-                )
+        # Validate emails (vectorized; Arrow regex kernels take the pattern string)
+        email_ok = employees["email"].str.fullmatch(EMAIL_RE.pattern).fillna(False)
+        add_errors(employees.index[~email_ok], "email", "Invalid email")
 
-        # Deduplicate
-        employees = employees.drop_duplicates()
+        # Deduplicate on the natural key (row_id is unique per row, so a
+        # full-row comparison would never match)
+        employees = employees.drop_duplicates(subset=EMPLOYEE_KEY_COLS, keep="last")
 
         # Validate dates
         for col in ["start_date"]:
             employees[col] = pd.to_datetime(employees[col], errors="coerce")
-            for idx, val in employees[col].items():
-                if pd.isna(val):
-                    errors.append(
-                        {"row_id": idx, "field": col, "error_reason": "Invalid date"}
-                    )
+            add_errors(employees.index[employees[col].isna()], col, "Invalid date")
 
-        # Carry forward titles
-        employees["title"] = employees.groupby("full_name")["title"].ffill().bfill()
-    else:
-        errors = []
+        # Fill missing titles with the person's first known title
+        known_titles = (
+            employees.dropna(subset=["full_name", "title"])
+            .drop_duplicates("full_name")
+            .set_index("full_name")["title"]
+        )
+        employees["title"] = employees["title"].fillna(
+            employees["full_name"].map(known_titles)
+        )
 
     # -----------------------------
     # Plans and Claims cleaning
@@ -131,64 +269,71 @@ def run_etl():
     # -----------------------------
     # Enrichment (mock API)
     # -----------------------------
-    enrichment_cache = {}
-
-    def enrich_company(ein):
-        if ein in enrichment_cache:
-            logging.info(f"Cache hit for EIN {ein}")
-            return enrichment_cache[ein]
-
-        for attempt in range(1, 4):  # 3 attempts
-            try:
-                logging.info(f"Attempt {attempt} for enriching EIN {ein}")
-                if random() < 0.2:  # simulate 20% API failure
-                    raise Exception("Temporary API failure")
-                enrichment_cache[ein] = api_mock
-                logging.info(f"Enrichment successful for EIN {ein}")
-                return api_mock
-            except Exception as e:
-                wait_time = 0.5 * attempt
-                logging.warning(
-                    f"Enrichment attempt {attempt} failed for EIN {ein}: {e}. Retrying in {wait_time}s"
-                )
-                time.sleep(wait_time)
-
-        # After retries fail
-        logging.error(
-            f"Enrichment failed for EIN {ein} after 3 attempts. Using defaults."
-        )
-        enrichment_cache[ein] = {"industry": None, "revenue": None, "headcount": None}
-        return enrichment_cache[ein]
+    with Cache(ENRICH_CACHE_DIR) as enrichment_cache:
+        cache_lock = threading.Lock()
 
-    if not employees.empty:
-        unique_eins = employees["company_ein"].dropna().unique()
-        enrichment_df = pd.DataFrame(
-            [{"company_ein": ein, **enrich_company(ein)} for ein in unique_eins]
-        )
+        def enrich_company(ein):
+            cached = enrichment_cache.get(ein)
+            if cached is not None:
+                logging.info(f"Cache hit for EIN {ein}")
+                return cached
+
+            for attempt in range(1, 4):  # 3 attempts
+                try:
+                    logging.info(f"Attempt {attempt} for enriching EIN {ein}")
+                    if random() < 0.2:  # simulate 20% API failure
+                        raise Exception("Temporary API failure")
+                    with cache_lock:
+                        enrichment_cache.set(ein, api_mock, expire=ENRICH_CACHE_TTL)
+                    logging.info(f"Enrichment successful for EIN {ein}")
+                    return api_mock
+                except Exception as e:
+                    wait_time = 0.5 * attempt
+                    logging.warning(
+                        f"Enrichment attempt {attempt} failed for EIN {ein}: {e}. Retrying in {wait_time}s"
+                    )
+                    time.sleep(wait_time)
+
+            # After retries fail
+            logging.error(
+                f"Enrichment failed for EIN {ein} after 3 attempts. Using defaults."
+            )
+            # Not cached, so the next run retries this EIN
+            return {"industry": None, "revenue": None, "headcount": None}
+
+        if not employees.empty:
+            unique_eins = employees["company_ein"].dropna().unique()
+            # Calls are I/O/sleep bound, so overlap them (including retries) in threads
+            with ThreadPoolExecutor(max_workers=ENRICH_MAX_WORKERS) as ex:
+                results = list(ex.map(enrich_company, unique_eins))
+            # Built column-wise and typed as strings so batches where every lookup
+            # failed keep the same Parquet schema as the rest of the dataset
+            enrichment_df = pd.DataFrame(
+                {
+                    "company_ein": unique_eins,
+                    **{
+                        col: pd.array([r[col] for r in results], dtype=_STR)
+                        for col in ["industry", "revenue", "headcount"]
+                    },
+                }
+            )
 
-        # Merge enrichment
-        employees = employees.merge(enrichment_df, on="company_ein", how="left")
+            # Merge enrichment
+            employees = employees.merge(enrichment_df, on="company_ein", how="left")
 
     # -----------------------------
     # Write validation errors
     # -----------------------------
-    pd.DataFrame(errors).to_csv(
+    pd.DataFrame(
+        {"row_id": err_ids, "field": err_fields, "error_reason": err_reasons}
+    ).to_csv(
         os.path.join(OUTPUT_DIR, "validation_errors.csv"), index=False
     )
 
     # -----------------------------
-    # Write cleaned/merged Parquet
-    # -----------------------------
-    clean_file = os.path.join(OUTPUT_DIR, "clean_data.parquet")
-    if not employees.empty:
-        if os.path.exists(clean_file):
-            old_df = pd.read_parquet(clean_file)
-            employees = pd.concat([old_df, employees]).drop_duplicates()
-        employees.to_parquet(clean_file, index=False)
-
-    # -----------------------------
-    # Update high-water mark
+    # Write cleaned/merged Parquet + update high-water mark
     # -----------------------------
+    prev_employees_hwm = hwm["employees"]
     hwm["employees"] = (
         str(employees["start_date"].max()) if not employees.empty else hwm["employees"]
     )
@@ -197,8 +342,12 @@ def run_etl():
         str(claims["service_date"].max()) if not claims.empty else hwm["claims"]
     )
 
-    with open(HWM_FILE, "w") as f:
-        json.dump(hwm, f)
+    if not employees.empty:
+        append_clean_data(
+            pa.Table.from_pandas(employees, preserve_index=False), prev_employees_hwm
+        )
+    write_hwm(hwm)
 
-    logging.info(f"Rows processed: {len(employees)}, Validation errors: {len(errors)}")
-    print(f"Rows processed: {len(employees)}, Validation errors: {len(errors)}")
+    summary = f"Rows processed: {len(employees)}, Validation errors: {len(err_ids)}"
+    logging.info(summary)
+    print(summary)
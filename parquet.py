@@ -1,14 +1,21 @@
 # manual inspection of the clean_data file
-import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
-# Load the Parquet file
-df = pd.read_parquet("outputs/clean_data.parquet")
+# Open the Parquet dataset (only file footers are read here)
+dataset = ds.dataset("outputs/clean_data.parquet", format="parquet")
 
-# Show the first few rows
-print(df.head())
+if not dataset.files:
+    print("outputs/clean_data.parquet contains no Parquet files yet.")
+else:
+    # Check column names and types, unified across every appended part
+    print(pa.unify_schemas([pq.read_schema(f) for f in dataset.files]))
 
-# Check column names
-print(df.columns)
+    # Summary
+    print(f"Files: {len(dataset.files)}, Rows: {dataset.count_rows()}")
+    first_file = pq.ParquetFile(dataset.files[0])
+    print(first_file.metadata)
 
-# Summary
-print(df.info())
+    # Show the first few rows (decodes only the first row group)
+    print(first_file.read_row_group(0).to_pandas().head())